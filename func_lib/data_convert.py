@@ -10,6 +10,8 @@ import datetime
 import numpy as np
 import pandas as pd
 
+from .haversine import EARTH_RADIUS_MILE, haversine_distance
+
 
 def stop_sequence_label(trip_stop_time_df: pd.DataFrame) -> pd.DataFrame:
     trip_stop_time_df = trip_stop_time_df.sort_values(by=['stop_sequence'])
@@ -110,6 +112,20 @@ def convert_route_type_to_link_type(route_type: str) -> str:
     return route_type_dict.get(int(route_type), '')
 
 
+# the conversions above as lookup tables over route_type 0-15, indexed by route_type
+NODE_TYPE_P_TABLE = np.array([convert_route_type_to_node_type_p(i) for i in range(16)], dtype=object)
+NODE_TYPE_S_TABLE = np.array([convert_route_type_to_node_type_s(i) for i in range(16)], dtype=object)
+LINK_TYPE_TABLE = np.array([convert_route_type_to_link_type(i) for i in range(16)], dtype=object)
+ALLOWED_USE_TABLE = np.array([allowed_use_function(i) for i in range(16)], dtype=object)
+
+
+# vectorized lookup of a route_type table, route types out of the table (e.g. extended types) convert to ""
+def lookup_route_type(route_type_table: np.ndarray, route_type: pd.Series) -> np.ndarray:
+    route_type_arr = np.asarray(route_type).astype(np.int64)
+    is_in_table = (route_type_arr >= 0) & (route_type_arr < len(route_type_table))
+    return np.where(is_in_table, route_type_table[np.where(is_in_table, route_type_arr, 0)], "")
+
+
 
 
 
@@ -132,6 +148,12 @@ def calculate_distance_from_geometry(lon1: float, lat1: float, lon2: float, lat2
 'Modify so that it reads weither mile or SI units are used.'
 
 
+# vectorized calculate_distance_from_geometry over arrays of WGS84 points, distance(mile)
+def calculate_distance_from_geometry_arr(lon1: np.ndarray, lat1: np.ndarray,
+                                         lon2: np.ndarray, lat2: np.ndarray) -> np.ndarray:
+    return haversine_distance(lon1, lat1, lon2, lat2, earth_radius=EARTH_RADIUS_MILE)
+
+
 
 
 
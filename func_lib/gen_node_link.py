@@ -5,17 +5,17 @@
 # Author/Copyright: Mr. Xiangyong Luo
 ##############################################################
 
-from pyufunc import func_running_time
+from gtfs2gmns.utility_lib import func_running_time
 import pandas as pd
 import time
 import numpy as np
+from scipy.spatial import cKDTree
 
-from .data_convert import (allowed_use_function,
-                                             allowed_use_transferring,
-                                             calculate_distance_from_geometry,
-                                             convert_route_type_to_link_type,
-                                             convert_route_type_to_node_type_p,
-                                             convert_route_type_to_node_type_s, transferring_penalty)
+from .data_convert import (ALLOWED_USE_TABLE, LINK_TYPE_TABLE, NODE_TYPE_P_TABLE, NODE_TYPE_S_TABLE,
+                           allowed_use_transferring,
+                           calculate_distance_from_geometry_arr,
+                           lookup_route_type, transferring_penalty)
+from .haversine import EARTH_RADIUS_MILE, haversine_scalar, njit, prange
 
 
 @func_running_time
@@ -28,23 +28,23 @@ def create_nodes(directed_trip_route_stop_time_df: pd.DataFrame, agency_num: int
     temp_df = directed_trip_route_stop_time_df.drop_duplicates(subset=['stop_id'])
     physical_node_df['name'] = temp_df['stop_id']
     physical_node_df = physical_node_df.sort_values(by=['name'])
-    physical_node_df['node_id'] = np.linspace(start=1, stop=len(physical_node_df),
-                                              num=len(physical_node_df)).astype('int32')
-    physical_node_df['node_id'] += int(f'{agency_num}00000') #Node ID number
+    physical_node_df['node_id'] = np.arange(1, len(physical_node_df) + 1,
+                                            dtype=np.int32) + int(f'{agency_num}00000') #Node ID number
     physical_node_df['physical_node_id'] = physical_node_df['node_id']
     physical_node_df['x_coord'] = temp_df['stop_lon'].astype(float)
     physical_node_df['y_coord'] = temp_df['stop_lat'].astype(float)
     physical_node_df['route_type'] = temp_df['route_type']
     physical_node_df['route_id'] = temp_df['route_id']
-    physical_node_df['node_type'] = physical_node_df.apply(
-        lambda x: convert_route_type_to_node_type_p(x.route_type), axis=1)
+    physical_node_df['node_type'] = lookup_route_type(NODE_TYPE_P_TABLE, physical_node_df['route_type'])
     physical_node_df['directed_route_id'] = ""
     physical_node_df['directed_service_id'] = ""
     physical_node_df['zone_id'] = ""
     physical_node_df['agency_name'] = temp_df['agency_name']
-    physical_node_df['geometry'] = 'POINT (' + physical_node_df['x_coord'].astype(str) + \
-        ' ' + physical_node_df['y_coord'].astype(str) + ')'
-    stop_name_id_dict = dict(zip(physical_node_df['name'], physical_node_df['node_id']))
+    # one formatting pass over python floats, same text as str(float)
+    physical_node_df['geometry'] = [f'POINT ({x} {y})' for x, y in
+                                    zip(physical_node_df['x_coord'].tolist(), physical_node_df['y_coord'].tolist())]
+    # stop_id -> physical node_id, indexed by stop_id for the service node lookup
+    stop_id_to_node_id = pd.Series(physical_node_df['node_id'].to_numpy(), index=physical_node_df['name'].to_numpy())
     physical_node_df['terminal_flag'] = temp_df['terminal_flag']
     physical_node_df['ctrl_type'] = ""
     physical_node_df['agent_type'] = ""
@@ -56,11 +56,9 @@ def create_nodes(directed_trip_route_stop_time_df: pd.DataFrame, agency_num: int
     # 2.2.2 route stop node
     service_node_df['name'] = temp_df['directed_service_stop_id']
     service_node_df = service_node_df.sort_values(by=['name'])
-    service_node_df['node_id'] = np.linspace(start=1, stop=len(service_node_df),
-                                             num=len(service_node_df)).astype('int32')
-    service_node_df['physical_node_id'] = temp_df.apply(
-        lambda x: stop_name_id_dict[x.stop_id], axis=1)
-    service_node_df['node_id'] += int(f'{agency_num}50000') #Service Node ID number
+    service_node_df['node_id'] = np.arange(1, len(service_node_df) + 1,
+                                           dtype=np.int32) + int(f'{agency_num}50000') #Service Node ID number
+    service_node_df['physical_node_id'] = temp_df['stop_id'].map(stop_id_to_node_id).astype('int32')
 
     service_node_df['x_coord'] = temp_df['stop_lon'].astype(
         float) - 0.000100
@@ -68,15 +66,14 @@ def create_nodes(directed_trip_route_stop_time_df: pd.DataFrame, agency_num: int
         float) - 0.000100
     service_node_df['route_type'] = temp_df['route_type']
     service_node_df['route_id'] = temp_df['route_id']
-    service_node_df['node_type'] = service_node_df.apply(
-        lambda x: convert_route_type_to_node_type_s(x.route_type), axis=1)
+    service_node_df['node_type'] = lookup_route_type(NODE_TYPE_S_TABLE, service_node_df['route_type'])
     # node_csv['terminal_flag'] = ' '
     service_node_df['directed_route_id'] = temp_df['directed_route_id'].astype(str)
     service_node_df['directed_service_id'] = temp_df['directed_service_id'].astype(str)
     service_node_df['zone_id'] = ""
     service_node_df['agency_name'] = temp_df['agency_name']
-    service_node_df['geometry'] = 'POINT (' + service_node_df['x_coord'].astype(str) + \
-        ' ' + service_node_df['y_coord'].astype(str) + ')'
+    service_node_df['geometry'] = [f'POINT ({x} {y})' for x, y in
+                                   zip(service_node_df['x_coord'].tolist(), service_node_df['y_coord'].tolist())]
 
     service_node_df['terminal_flag'] = temp_df['terminal_flag']
     service_node_df['ctrl_type'] = ""
@@ -98,288 +95,319 @@ def create_service_boarding_links(directed_trip_route_stop_time_df: pd.DataFrame
 
     # initialize dictionaries
     node_id_dict = dict(zip(node_df['name'], node_df['node_id']))
-    directed_service_dict = dict(zip(node_df['node_id'], node_df['name']))
     node_lon_dict = dict(zip(node_df['node_id'], node_df['x_coord']))
     node_lat_dict = dict(zip(node_df['node_id'], node_df['y_coord']))
-    frequency_dict = {}
 
     print("Info: 1. start creating route links...")
     # generate service links
-    number_of_route_links = 0
-    iteration_group = directed_trip_route_stop_time_df.groupby('directed_service_id')
-    labeled_directed_service_list = []
-
-    time_start = time.time()
-    for directed_service_id, route_df in iteration_group:
-        if directed_service_id in labeled_directed_service_list:
-            continue
-        else:
-            labeled_directed_service_list.append(directed_service_id)
-            number_of_trips = len(route_df.trip_id.unique())
-            # note the frequency of routes
-            frequency_dict[directed_service_id] = number_of_trips
-            one_line_df = route_df[route_df.trip_id == route_df.trip_id.unique()[0]]
-            one_line_df = one_line_df.sort_values(by=['stop_sequence'])
-            number_of_records = len(one_line_df)
-            one_line_df = one_line_df.reset_index()
-
-            for k in range(number_of_records - 1):
-                link_id = linkoffset * agency_num + number_of_route_links + 1
-                from_node_id = node_id_dict[one_line_df.iloc[k].directed_service_stop_id]
-                to_node_id = node_id_dict[one_line_df.iloc[k + 1].directed_service_stop_id]
-                facility_type = convert_route_type_to_link_type(one_line_df.iloc[k].route_type)
-                dir_flag = 1
-                directed_route_id = one_line_df.iloc[k].directed_route_id
-                link_type = 1
-                link_type_name = 'transit_service_links'
-                from_node_lon = float(one_line_df.iloc[k].stop_lon)
-                from_node_lat = float(one_line_df.iloc[k].stop_lat)
-                to_node_lon = float(one_line_df.iloc[k + 1].stop_lon)
-                to_node_lat = float(one_line_df.iloc[k + 1].stop_lat)
-                length = calculate_distance_from_geometry(
-                    from_node_lon, from_node_lat, to_node_lon, to_node_lat)
-                
-                
-                lanes = 1 # number_of_trips THlIS NEEDS TO BE ADRESSED!!!! HOW DO WE SIGNIFLY TRIPS
-                
-                
-                capacity = 0
-                VDF_fftt1 = one_line_df.iloc[k + 1].arrival_time - one_line_df.iloc[k].arrival_time
-                VDF_fftt1 = one_line_df.iloc[k + 1].arrival_time - one_line_df.iloc[k].arrival_time
-                # minutes
-                VDF_cap1 = lanes * capacity
-                x = VDF_fftt1.seconds
-                
-                '''Make so that it can calc SI units???'''
-                
-                free_speed = (length / (VDF_fftt1.seconds + 0.001)) * 3600      ######Verified########
-                #free_speed = ((length / 1000) / (VDF_fftt1.seconds / 3600 + 0.001)) * 60     This line is wrong. Maybe for meters to kh/hr?
-                # (kilometers/minutes)*60 = kilometer/hour
-                
-                VDF_alpha1 = 0.15
-                VDF_beta1 = 4
-                VDF_penalty1 = 0
-                cost = 0
-                geometry = 'LINESTRING (' + str(from_node_lon) + ' ' + str(from_node_lat) + ', ' + \
-                    str(to_node_lon) + ' ' + str(to_node_lat) + ')'
-                agency_name = one_line_df.agency_name[0]
-                allowed_use = allowed_use_function(one_line_df.iloc[k].route_type) 
-                stop_sequence = one_line_df.iloc[k].stop_sequence
-                directed_service_id = one_line_df.iloc[k].directed_service_id
-                link_list = [link_id, 
-                             from_node_id, 
-                             to_node_id, 
-                             facility_type, 
-                             dir_flag, 
-                             directed_route_id,
-                             link_type, 
-                             link_type_name, 
-                             length, 
-                             lanes, 
-                             capacity, 
-                             free_speed, 
-                             cost,
-                             VDF_fftt1, 
-                             VDF_cap1, 
-                             VDF_alpha1, 
-                             VDF_beta1, 
-                             VDF_penalty1, 
-                             geometry, 
-                             allowed_use,
-                             agency_name,
-                             stop_sequence, directed_service_id]
-                one_agency_link_list.append(link_list)
-                number_of_route_links += 1
-                if number_of_route_links % 100 == 0:
-                    time_end = time.time()
-                    print('convert ', number_of_route_links,
-                          'service links successfully...', 'using time', time_end - time_start, 's')
+    time_start = time.perf_counter()
+    service_group = directed_trip_route_stop_time_df.groupby('directed_service_id', sort=False)
+
+    # note the frequency of routes
+    frequency_dict = service_group['trip_id'].nunique().to_dict()
+
+    # one representative (the first) trip per directed service, stops in sequence order
+    first_trip_id = service_group['trip_id'].transform('first')
+    one_line_df = directed_trip_route_stop_time_df[directed_trip_route_stop_time_df.trip_id == first_trip_id]
+    one_line_df = one_line_df.sort_values(by=['directed_service_id', 'stop_sequence'], kind='stable')
+
+    # each link goes from a stop to the next stop of the same service, the last stop of a service has no link
+    one_line_group = one_line_df.groupby('directed_service_id', sort=False)
+    to_service_stop_id = one_line_group['directed_service_stop_id'].shift(-1)
+    to_stop_lon = one_line_group['stop_lon'].shift(-1)
+    to_stop_lat = one_line_group['stop_lat'].shift(-1)
+    to_arrival_time = one_line_group['arrival_time'].shift(-1)
+    agency_name = one_line_group['agency_name'].transform('first')
+    has_next = to_service_stop_id.notna()
+    route_df = one_line_df[has_next]
+
+    from_node_lon = route_df['stop_lon'].astype(float)
+    from_node_lat = route_df['stop_lat'].astype(float)
+    to_node_lon = to_stop_lon[has_next].astype(float)
+    to_node_lat = to_stop_lat[has_next].astype(float)
+    length = pd.Series(calculate_distance_from_geometry_arr(from_node_lon, from_node_lat, to_node_lon, to_node_lat),
+                       index=route_df.index)
+    VDF_fftt1 = to_arrival_time[has_next] - route_df['arrival_time']
+
+    lanes = 1  # number_of_trips THlIS NEEDS TO BE ADRESSED!!!! HOW DO WE SIGNIFLY TRIPS
+    capacity = 0
+    number_of_route_links = len(route_df)
+    service_link_df = pd.DataFrame({
+        'link_id': linkoffset * agency_num + np.arange(1, number_of_route_links + 1),
+        'from_node_id': route_df['directed_service_stop_id'].map(node_id_dict),
+        'to_node_id': to_service_stop_id[has_next].map(node_id_dict),
+        'facility_type': lookup_route_type(LINK_TYPE_TABLE, route_df['route_type']),
+        'dir_flag': 1,
+        'directed_route_id': route_df['directed_route_id'],
+        'link_type': 1,
+        'link_type_name': 'transit_service_links',
+        'length': length,
+        'lanes': lanes,
+        'capacity': capacity,
+        # (mile/second)*3600 = mile/hour  ######Verified########
+        'free_speed': (length / (VDF_fftt1.dt.seconds + 0.001)) * 3600,
+        'cost': 0,
+        'VDF_fftt1': VDF_fftt1,
+        'VDF_cap1': lanes * capacity,
+        'VDF_alpha1': 0.15,
+        'VDF_beta1': 4,
+        'VDF_penalty1': 0,
+        'geometry': [f'LINESTRING ({x1} {y1}, {x2} {y2})' for x1, y1, x2, y2 in
+                     zip(from_node_lon.tolist(), from_node_lat.tolist(), to_node_lon.tolist(), to_node_lat.tolist())],
+        'allowed_use': lookup_route_type(ALLOWED_USE_TABLE, route_df['route_type']),
+        'agency_name': agency_name[has_next],
+        'stop_sequence': route_df['stop_sequence'],
+        'directed_service_id': route_df['directed_service_id'],
+    })
+    one_agency_link_list.append(service_link_df)
+    print('convert ', number_of_route_links,
+          'service links successfully...', 'using time', time.perf_counter() - time_start, 's')
 
     print("2. start creating boarding links from stations to their passing routes...")
     """boarding_links"""
-    service_node_df = node_df[node_df.node_id != node_df.physical_node_id]
     #  select service node from node_df
-    service_node_df = service_node_df.reset_index()
-    number_of_sta2route_links = 1 #To prevent overlap with service links
-    for iter, row in service_node_df.iterrows():
-        link_id = agency_num * linkoffset + number_of_route_links + number_of_sta2route_links
-        from_node_id = row.physical_node_id
-        to_node_id = row.node_id
-        facility_type = convert_route_type_to_link_type(row.route_type)
-        dir_flag = 1
-        directed_route_id = row.directed_route_id
-        link_type = 2
-        link_type_name = 'transit_boarding_links'
-        to_node_lon = row.x_coord
-        to_node_lat = row.y_coord
-        from_node_lon = node_lon_dict[row.physical_node_id]
-        from_node_lat = node_lat_dict[row.physical_node_id]
-        length = calculate_distance_from_geometry(
-            from_node_lon, from_node_lat, to_node_lon, to_node_lat)
-        free_speed = 2
-        lanes = 1
-        capacity = 0
-        VDF_cap1 = lanes * capacity
-        VDF_alpha1 = 0.15
-        VDF_beta1 = 4
-        VDF_penalty1 = 0
-        cost = 0
-        stop_sequence = -1
-        directed_service_id = directed_service_dict[to_node_id]
-        geometry = 'LINESTRING (' + str(from_node_lon) + ' ' + str(from_node_lat) + ', ' + \
-            str(to_node_lon) + ' ' + str(to_node_lat) + ')'
-        agency_name = row.agency_name
-        allowed_use = allowed_use_function(row.route_type)
-
-        # inbound links (boarding)
-
-        VDF_fftt1 = 0.5 * ((period_end_time - period_start_time) / frequency_dict[row.directed_service_id])
-        VDF_fftt1 = min(VDF_fftt1.seconds / 60, 10)
-        # waiting time at a station is 10 minutes at most
-        geometry = 'LINESTRING (' + str(to_node_lon) + ' ' + str(to_node_lat) + ', ' + \
-            str(from_node_lon) + ' ' + str(from_node_lat) + ')'
-        # inbound link is average waiting time derived from frequency
-        link_list_inbound = [link_id, from_node_id, to_node_id, facility_type, dir_flag, directed_route_id,
-                             link_type, link_type_name, length, lanes, capacity, free_speed, cost,
-                             VDF_fftt1, VDF_cap1, VDF_alpha1, VDF_beta1, VDF_penalty1, geometry, allowed_use,
-                             agency_name,
-                             stop_sequence, directed_service_id]
-        number_of_sta2route_links += 1
-
-        # outbound links (boarding)
-        link_id = agency_num * linkoffset + number_of_route_links + number_of_sta2route_links
-        VDF_fftt1 = 1  # (length / free_speed) * 60
-        #  the time of outbound time
-        link_list_outbound = [link_id, 
-                              to_node_id, 
-                              from_node_id, 
-                              facility_type, 
-                              dir_flag, 
-                              directed_route_id,
-                              link_type, 
-                              link_type_name, 
-                              length, 
-                              lanes, 
-                              capacity, 
-                              free_speed, 
-                              cost,
-                              VDF_fftt1, 
-                              VDF_cap1, 
-                              VDF_alpha1, 
-                              VDF_beta1, 
-                              VDF_penalty1, 
-                              geometry, 
-                              allowed_use,
-                              agency_name,
-                              stop_sequence, 
-                              directed_service_id]
-        one_agency_link_list.append(link_list_inbound)
-        one_agency_link_list.append(link_list_outbound)
-        number_of_sta2route_links += 1
-        #  one inbound link and one outbound link
-        if number_of_sta2route_links % 100 == 0:
-            time_end = time.time()
-            print('convert ', number_of_sta2route_links,
-                  'boarding links successfully...', 'using time', time_end - time_start, 's')
+    service_node_df = node_df[node_df.node_id != node_df.physical_node_id]
+    number_of_service_nodes = len(service_node_df)
+
+    # each service node has an inbound link from its station and an outbound link back to the station
+    from_node_lon = service_node_df['physical_node_id'].map(node_lon_dict)
+    from_node_lat = service_node_df['physical_node_id'].map(node_lat_dict)
+    to_node_lon = service_node_df['x_coord']
+    to_node_lat = service_node_df['y_coord']
+    length = calculate_distance_from_geometry_arr(from_node_lon, from_node_lat, to_node_lon, to_node_lat)
+
+    # inbound link is average waiting time derived from frequency, computed once per directed service
+    # waiting time at a station is 10 minutes at most
+    # (kept as object, the capped waiting time is the integer 10)
+    waiting_time = pd.Series({
+        directed_service_id: min((0.5 * ((period_end_time - period_start_time) / frequency)).seconds / 60, 10)
+        for directed_service_id, frequency in frequency_dict.items()}, dtype=object)
+
+    # link ids follow number_of_route_links, one inbound and one outbound link per service node
+    link_id = agency_num * linkoffset + number_of_route_links + 1 + 2 * np.arange(number_of_service_nodes)
+    # both links share the station-to-route geometry
+    geometry = [f'LINESTRING ({x1} {y1}, {x2} {y2})' for x1, y1, x2, y2 in
+                zip(to_node_lon.tolist(), to_node_lat.tolist(), from_node_lon.tolist(), from_node_lat.tolist())]
+    lanes = 1
+    capacity = 0
+    inbound_link_df = pd.DataFrame({
+        'link_id': link_id,
+        'from_node_id': service_node_df['physical_node_id'].to_numpy(),
+        'to_node_id': service_node_df['node_id'].to_numpy(),
+        'facility_type': lookup_route_type(LINK_TYPE_TABLE, service_node_df['route_type']),
+        'dir_flag': 1,
+        'directed_route_id': service_node_df['directed_route_id'].to_numpy(),
+        'link_type': 2,
+        'link_type_name': 'transit_boarding_links',
+        'length': length,
+        'lanes': lanes,
+        'capacity': capacity,
+        'free_speed': 2,
+        'cost': 0,
+        'VDF_fftt1': service_node_df['directed_service_id'].map(waiting_time).to_numpy(),
+        'VDF_cap1': lanes * capacity,
+        'VDF_alpha1': 0.15,
+        'VDF_beta1': 4,
+        'VDF_penalty1': 0,
+        'geometry': geometry,
+        'allowed_use': lookup_route_type(ALLOWED_USE_TABLE, service_node_df['route_type']),
+        'agency_name': service_node_df['agency_name'].to_numpy(),
+        'stop_sequence': -1,
+        'directed_service_id': service_node_df['name'].to_numpy(),
+    })
+    # the time of outbound time
+    outbound_link_df = inbound_link_df.assign(link_id=link_id + 1,
+                                              from_node_id=inbound_link_df['to_node_id'],
+                                              to_node_id=inbound_link_df['from_node_id'],
+                                              VDF_fftt1=1)  # (length / free_speed) * 60
+
+    # inbound and outbound links of the same service node are next to each other
+    inbound_link_df.index = 2 * inbound_link_df.index
+    outbound_link_df.index = inbound_link_df.index + 1
+    one_agency_link_list.append(pd.concat([inbound_link_df, outbound_link_df]).sort_index())
+    print('convert ', 2 * number_of_service_nodes,
+          'boarding links successfully...', 'using time', time.perf_counter() - time_start, 's')
 
     return one_agency_link_list
 
 
+def _select_transferring_pairs_numpy(offsets: np.ndarray, neighbors: np.ndarray,
+                                     x_coord: np.ndarray, y_coord: np.ndarray, route_agency_code: np.ndarray,
+                                     min_length: float, max_length: float, max_routes: int) -> tuple:
+    pair_i = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    pair_j = neighbors
+
+    # skip the nodes of the same route and agency, then the ones too far or too close
+    is_other_route = route_agency_code[pair_j] != route_agency_code[pair_i]
+    pair_i, pair_j = pair_i[is_other_route], pair_j[is_other_route]
+    length = calculate_distance_from_geometry_arr(x_coord[pair_i], y_coord[pair_i], x_coord[pair_j], y_coord[pair_j])
+    is_in_range = ~((length > max_length) | (length < min_length))
+    pair_i, pair_j, length = pair_i[is_in_range], pair_j[is_in_range], length[is_in_range]
+
+    # consider only one stop of another route (the first one) ...
+    key = pair_i.astype(np.int64) * (int(route_agency_code.max(initial=0)) + 1) + route_agency_code[pair_j]
+    _, first_index = np.unique(key, return_index=True)
+    first_index.sort()
+    pair_i, pair_j, length = pair_i[first_index], pair_j[first_index], length[first_index]
+
+    # ... and at most max_routes routes per node
+    rank = np.arange(len(pair_i)) - np.searchsorted(pair_i, pair_i, side='left')
+    is_kept = rank < max_routes
+    return pair_i[is_kept], pair_j[is_kept], length[is_kept]
+
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _select_transferring_pairs_numba(offsets: np.ndarray, neighbors: np.ndarray,
+                                         x_coord: np.ndarray, y_coord: np.ndarray, route_agency_code: np.ndarray,
+                                         min_length: float, max_length: float, max_routes: int) -> tuple:
+        number_of_nodes = offsets.shape[0] - 1
+
+        # at most max_routes slots per node, filled independently per node
+        slot_j = np.full((number_of_nodes, max_routes), -1, dtype=np.int64)
+        slot_length = np.zeros((number_of_nodes, max_routes))
+        for i in prange(number_of_nodes):
+            count = 0
+            for k in range(offsets[i], offsets[i + 1]):
+                if count >= max_routes:
+                    break
+                j = neighbors[k]
+                if route_agency_code[j] == route_agency_code[i]:
+                    continue
+                length = haversine_scalar(x_coord[i], y_coord[i], x_coord[j], y_coord[j], EARTH_RADIUS_MILE)
+                if (length > max_length) | (length < min_length):
+                    continue
+                # the labeled routes of node i are its (at most max_routes) filled slots
+                is_labeled = False
+                for q in range(count):
+                    if route_agency_code[slot_j[i, q]] == route_agency_code[j]:
+                        is_labeled = True
+                        break
+                if is_labeled:
+                    continue
+                slot_j[i, count] = j
+                slot_length[i, count] = length
+                count += 1
+
+        pair_i, slot = np.nonzero(slot_j >= 0)
+        pair_j = np.empty(pair_i.shape[0], dtype=np.int64)
+        length = np.empty(pair_i.shape[0])
+        for k in range(pair_i.shape[0]):
+            pair_j[k] = slot_j[pair_i[k], slot[k]]
+            length[k] = slot_length[pair_i[k], slot[k]]
+        return pair_i, pair_j, length
+
+
+def _select_transferring_pairs(neighbor_index_lists: list, x_coord: np.ndarray, y_coord: np.ndarray,
+                               route_agency_code: np.ndarray,
+                               min_length: float = 1, max_length: float = 321.869, max_routes: int = 10) -> tuple:
+    """select the (from, to) node position pairs of transferring links and their length
+
+    For each node, its neighbors are visited in order;
+    the nodes of the same route and agency and the ones out of [min_length, max_length] are skipped,
+    then only the first node of each other (route, agency) is kept, for at most max_routes routes.
+
+    Returns:
+        tuple: (pair_i, pair_j, length) arrays, ordered by pair_i then neighbor order
+    """
+    offsets = np.zeros(len(neighbor_index_lists) + 1, dtype=np.int64)
+    np.cumsum([len(index_list) for index_list in neighbor_index_lists], out=offsets[1:])
+    # all neighbor lists back to back in one C-level concatenation, node i owns neighbors[offsets[i]:offsets[i + 1]]
+    neighbors = (np.concatenate(neighbor_index_lists).astype(np.int64, copy=False) if offsets[-1]
+                 else np.empty(0, dtype=np.int64))
+    route_agency_code = route_agency_code.astype(np.int64)
+    x_coord = np.ascontiguousarray(x_coord, dtype=np.float64)
+    y_coord = np.ascontiguousarray(y_coord, dtype=np.float64)
+
+    if njit is not None:
+        return _select_transferring_pairs_numba(offsets, neighbors, x_coord, y_coord, route_agency_code,
+                                                float(min_length), float(max_length), int(max_routes))
+    return _select_transferring_pairs_numpy(offsets, neighbors, x_coord, y_coord, route_agency_code,
+                                            min_length, max_length, max_routes)
+
+
 @func_running_time
 def create_transferring_links(all_node_df: pd.DataFrame, all_link_list: list) -> list:
 
     physical_node_df = all_node_df[all_node_df.node_id ==
                                    all_node_df.physical_node_id]
-    physical_node_df = physical_node_df.reset_index()
-    number_of_transferring_links = 0
-    time_start = time.time()
-
-    for i in range(len(physical_node_df)):
-        ref_x = physical_node_df.iloc[i].x_coord
-        ref_y = physical_node_df.iloc[i].y_coord
-
-        mask1 = physical_node_df.x_coord >= (ref_x - 0.003)
-        mask2 = physical_node_df.x_coord <= (ref_x + 0.003)
-        mask3 = physical_node_df.y_coord >= (ref_y - 0.003)
-        mask4 = physical_node_df.y_coord <= (ref_y + 0.003)
-
-        neighboring_node_df = physical_node_df[mask1 & mask2 & mask3 & mask4]
-
-        # neighboring_node_df = physical_node_df[(physical_node_df.x_coord >= (ref_x - 0.003)) &
-        #                                        (physical_node_df.x_coord <= (ref_x + 0.003))]
-        # neighboring_node_df = neighboring_node_df[(neighboring_node_df.y_coord >= (ref_y - 0.003)) &
-        #                                           (neighboring_node_df.y_coord <= (ref_y + 0.003))]
-
-        labeled_list = []
-        count = 0
-        for j in range(len(neighboring_node_df)):
-            if count >= 10:
-                break
-            if (physical_node_df.iloc[i].route_id, physical_node_df.iloc[i].agency_name) == \
-                    (neighboring_node_df.iloc[j].route_id, neighboring_node_df.iloc[j].agency_name):
-                continue
-            from_node_lon = float(physical_node_df.iloc[i].x_coord)
-            from_node_lat = float(physical_node_df.iloc[i].y_coord)
-            to_node_lon = float(neighboring_node_df.iloc[j].x_coord)
-            to_node_lat = float(neighboring_node_df.iloc[j].y_coord)
-            length = calculate_distance_from_geometry(
-                from_node_lon, from_node_lat, to_node_lon, to_node_lat)
-            if (length > 321.869) | (length < 1):
-                continue
-            if (neighboring_node_df.iloc[j].route_id, neighboring_node_df.iloc[j].agency_name) in labeled_list:
-                continue
-            count += 1
-            labeled_list.append(
-                (neighboring_node_df.iloc[j].route_id, neighboring_node_df.iloc[j].agency_name))
-            # consider only one stops of another route
-            # transferring 1
-            #  print('transferring link length =', length)
-            link_id = number_of_transferring_links + 1
-            from_node_id = physical_node_df.iloc[i].node_id
-            to_node_id = neighboring_node_df.iloc[j].node_id
-            facility_type = 'sta2sta'
-            dir_flag = 1
-            directed_route_id = -1
-            link_type = 3
-            link_type_name = 'transferring_links'
-            lanes = 1
-            capacity = 0
-            VDF_fftt1 = (length / 1000) / 1
-            VDF_cap1 = lanes * capacity
-            free_speed = 1
-            # 1 kilo/hour
-            VDF_alpha1 = 0.15
-            VDF_beta1 = 4
-            VDF_penalty1 = transferring_penalty(
-                physical_node_df.iloc[i].node_type, neighboring_node_df.iloc[j].node_type)
-            # penalty of transferring
-            cost = 60
-            geometry = 'LINESTRING (' + str(from_node_lon) + ' ' + str(from_node_lat) + ', ' + \
-                str(to_node_lon) + ' ' + str(to_node_lat) + ')'
-            agency_name = ""
-            allowed_use = allowed_use_transferring(
-                physical_node_df.iloc[i].node_type, neighboring_node_df.iloc[j].node_type)
-            stop_sequence = ""
-            directed_service_id = ""
-            link_list = [link_id, from_node_id, to_node_id, facility_type, dir_flag, directed_route_id,
-                         link_type, link_type_name, length, lanes, capacity, free_speed, cost,
-                         VDF_fftt1, VDF_cap1, VDF_alpha1, VDF_beta1, VDF_penalty1, geometry, allowed_use, agency_name,
-                         stop_sequence, directed_service_id]
-            all_link_list.append(link_list)
-            # transferring 2
-            number_of_transferring_links += 1
-            geometry = 'LINESTRING (' + str(to_node_lon) + ' ' + str(to_node_lat) + ', ' + \
-                str(from_node_lon) + ' ' + str(from_node_lat) + ')'
-            link_id = number_of_transferring_links + 1
-            link_list = [link_id, to_node_id, from_node_id, facility_type, dir_flag, directed_route_id,
-                         link_type, link_type_name, length, lanes, capacity, free_speed, cost,
-                         VDF_fftt1, VDF_cap1, VDF_alpha1, VDF_beta1, VDF_penalty1, geometry, allowed_use, agency_name,
-                         stop_sequence, directed_service_id]
-            all_link_list.append(link_list)
-            number_of_transferring_links += 1
-            if number_of_transferring_links % 50 == 0:
-                time_end = time.time()
-                print('convert ', number_of_transferring_links,
-                      'transferring links successfully...', 'using time', time_end - time_start, 's')
+    time_start = time.perf_counter()
+
+    # spatial index over the physical nodes, neighbors of a node are the nodes within
+    # +/- 0.003 degree in both x and y, i.e. a Chebyshev (p=inf) ball, in node order
+    coords = physical_node_df[['x_coord', 'y_coord']].to_numpy(dtype=np.float64)
+    x_coord_arr = coords[:, 0]
+    y_coord_arr = coords[:, 1]
+    node_id_arr = physical_node_df['node_id'].to_numpy()
+    node_type_arr = physical_node_df['node_type'].to_numpy()
+    neighbor_index_lists = cKDTree(coords).query_ball_point(coords, r=0.003, p=np.inf,
+                                                               return_sorted=True, workers=-1)
+
+    # (route_id, agency_name) of each node as one integer code
+    route_agency_code = physical_node_df.groupby(['route_id', 'agency_name'],
+                                                 sort=False, dropna=False).ngroup().to_numpy()
+
+    pair_i, pair_j, pair_length = _select_transferring_pairs(neighbor_index_lists, x_coord_arr, y_coord_arr,
+                                                             route_agency_code)
+
+    # transferring_penalty and allowed_use_transferring of each pair of the few node types, as lookup tables
+    node_type_code, node_type_values = pd.factorize(node_type_arr)
+    penalty_table = np.array([[transferring_penalty(t1, t2) for t2 in node_type_values] for t1 in node_type_values],
+                             dtype=np.int64).reshape(len(node_type_values), len(node_type_values))
+    allowed_use_table = np.array([[allowed_use_transferring(t1, t2) for t2 in node_type_values]
+                                  for t1 in node_type_values],
+                                 dtype=object).reshape(len(node_type_values), len(node_type_values))
+    pair_type_i = node_type_code[pair_i]
+    pair_type_j = node_type_code[pair_j]
+
+    # transferring 1: from node i to node j, transferring 2: back from node j to node i
+    number_of_transferring_links = 2 * len(pair_i)
+    from_node_lon = x_coord_arr[pair_i].tolist()
+    from_node_lat = y_coord_arr[pair_i].tolist()
+    to_node_lon = x_coord_arr[pair_j].tolist()
+    to_node_lat = y_coord_arr[pair_j].tolist()
+    lanes = 1
+    capacity = 0
+    transferring_link_df = pd.DataFrame({
+        'link_id': 1 + 2 * np.arange(len(pair_i)),
+        'from_node_id': node_id_arr[pair_i],
+        'to_node_id': node_id_arr[pair_j],
+        'facility_type': 'sta2sta',
+        'dir_flag': 1,
+        'directed_route_id': -1,
+        'link_type': 3,
+        'link_type_name': 'transferring_links',
+        'length': pair_length,
+        'lanes': lanes,
+        'capacity': capacity,
+        # 1 kilo/hour
+        'free_speed': 1,
+        # penalty of transferring
+        'cost': 60,
+        'VDF_fftt1': (pair_length / 1000) / 1,
+        'VDF_cap1': lanes * capacity,
+        'VDF_alpha1': 0.15,
+        'VDF_beta1': 4,
+        'VDF_penalty1': penalty_table[pair_type_i, pair_type_j],
+        'geometry': [f'LINESTRING ({x1} {y1}, {x2} {y2})' for x1, y1, x2, y2 in
+                     zip(from_node_lon, from_node_lat, to_node_lon, to_node_lat)],
+        'allowed_use': allowed_use_table[pair_type_i, pair_type_j],
+        'agency_name': "",
+        'stop_sequence': "",
+        'directed_service_id': "",
+    })
+    reverse_link_df = transferring_link_df.assign(
+        link_id=transferring_link_df['link_id'] + 1,
+        from_node_id=transferring_link_df['to_node_id'],
+        to_node_id=transferring_link_df['from_node_id'],
+        geometry=[f'LINESTRING ({x2} {y2}, {x1} {y1})' for x1, y1, x2, y2 in
+                  zip(from_node_lon, from_node_lat, to_node_lon, to_node_lat)])
+
+    # the two directions of the same pair are next to each other
+    transferring_link_df.index = 2 * transferring_link_df.index
+    reverse_link_df.index = transferring_link_df.index + 1
+    all_link_list.append(pd.concat([transferring_link_df, reverse_link_df]).sort_index())
+    print('convert ', number_of_transferring_links,
+          'transferring links successfully...', 'using time', time.perf_counter() - time_start, 's')
 
     return all_link_list
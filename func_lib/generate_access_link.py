@@ -6,76 +6,155 @@
 ##############################################################
 
 
+from typing import Literal
+
 import pandas as pd
 import numpy as np
-from shapely.geometry import Point, LineString
+import shapely
 from scipy.spatial import cKDTree
-import pyufunc as uf
-from pyufunc import gmns_geo
-
-def generate_access_link(hwy_node_path: str, tran_node_path: str) -> pd.DataFrame:
-    # Load highway and transit node data
-    df_hwy_node = pd.read_csv(hwy_node_path, usecols=['node_id', 'x_coord', 'y_coord'])
-    df_tran_node = pd.read_csv(tran_node_path, usecols=['node_id', 'x_coord', 'y_coord', 'directed_service_id', 'node_type'])
 
-    # Filter real transit nodes (remove those with directed_service_id) & keep only "bus_service_node"
-    df_tran_node_real = df_tran_node[
-        
-        (df_tran_node['node_type'] == "bus_service_node")
-    ].copy()
+from gtfs2gmns.utility_lib import DEFAULT_CSV_READ_ENGINE
+from .haversine import haversine_distance
+
+# csv engine of the (large) highway node file, pyarrow if installed
+HWY_CSV_ENGINE = DEFAULT_CSV_READ_ENGINE
+
+# number of transit nodes queried and processed per block, keeps per-block result arrays cache resident
+QUERY_BLOCK_SIZE = 1 << 16
+
+# below this number of highway nodes a brute-force distance scan beats KDTree construction and descent,
+# brute-force queries are done in smaller blocks to bound the (block x highway nodes) distance matrix
+BRUTE_FORCE_MAX_HWY_NODES = 512
+BRUTE_FORCE_BLOCK_SIZE = 1 << 12
+
+
+def _query_nearest_brute_force(hwy_xy: np.ndarray, query_xy: np.ndarray, distance_upper_bound: float) -> tuple:
+    """same output as cKDTree.query(k=1): missing neighbors get index len(hwy_xy) and distance inf"""
+    d2 = ((query_xy[:, None, :] - hwy_xy[None, :, :]) ** 2).sum(-1)
+    indices = d2.argmin(1)
+    distances = np.sqrt(d2[np.arange(len(query_xy)), indices])
+    out_of_bound = distances > distance_upper_bound
+    indices[out_of_bound] = len(hwy_xy)
+    distances[out_of_bound] = np.inf
+    return distances, indices
+
+
+def generate_access_link(hwy_node_path: str, tran_node_path: str,
+                         geometry: Literal['none', 'wkt', 'shapely'] = 'wkt') -> pd.DataFrame:
+    """Generate access links between bus service nodes and their nearest highway node (within 10 km).
+
+    Args:
+        hwy_node_path (str): file path to highway node file, with node_id, x_coord, y_coord
+        tran_node_path (str): file path to transit node file, with node_id, x_coord, y_coord, node_type
+        geometry (str, optional): geometry column format, "wkt" for WKT strings,
+            "shapely" for shapely LineStrings, "none" to skip geometry. Defaults to "wkt".
+
+    Raises:
+        ValueError: geometry should be one of "none", "wkt", "shapely"
+
+    Returns:
+        pd.DataFrame: access links, one per matched bus service node
+    """
+    if geometry not in {'none', 'wkt', 'shapely'}:
+        raise ValueError('geometry should be one of "none", "wkt", "shapely".')
+
+    # Load transit node data, with dtypes fixed at parse time
+    df_tran_node = pd.read_csv(tran_node_path,
+                               usecols=['node_id', 'x_coord', 'y_coord', 'node_type'],
+                               dtype={'node_id': np.int64, 'x_coord': np.float64, 'y_coord': np.float64,
+                                      'node_type': 'category'},
+                               engine='c')
+
+    # Keep only "bus_service_node", compared on the integer category codes
+    # If no bus service nodes are found, return empty DataFrame before any further work
+    node_type = df_tran_node['node_type']
+    if "bus_service_node" not in node_type.cat.categories:
+        return pd.DataFrame()
+    mask = node_type.cat.codes.to_numpy() == node_type.cat.categories.get_loc("bus_service_node")
+    if not mask.any():
+        return pd.DataFrame()
 
-    # Convert coordinates to float for safety
-    df_hwy_node[['x_coord', 'y_coord']] = df_hwy_node[['x_coord', 'y_coord']].astype(float)
-    df_tran_node_real[['x_coord', 'y_coord']] = df_tran_node_real[['x_coord', 'y_coord']].astype(float)
+    # Load highway node data
+    df_hwy_node = pd.read_csv(hwy_node_path,
+                              usecols=['node_id', 'x_coord', 'y_coord'],
+                              dtype={'node_id': np.int64, 'x_coord': np.float64, 'y_coord': np.float64},
+                              engine=HWY_CSV_ENGINE)
 
     # Convert to NumPy arrays for fast computation
-    hwy_coords = df_hwy_node[['x_coord', 'y_coord']].to_numpy()
-    tran_coords = df_tran_node_real[['x_coord', 'y_coord']].to_numpy()
-
-    # If no bus service nodes are found, return empty DataFrame
-    if len(tran_coords) == 0:
-        return pd.DataFrame()
-
-    # Build KDTree for highway nodes (fast nearest neighbor search)
-    tree = cKDTree(hwy_coords)
-
-    # Query each transit node to find the nearest highway node
-    distances, indices = tree.query(tran_coords, distance_upper_bound=10000)
-
-    access_links = []
-
-    # Process each transit node (find its nearest highway node)
-    for i, tran_node_id in enumerate(df_tran_node_real['node_id']):
-        hwy_index = indices[i]
-
-        # Ignore if no valid highway node was found within the radius
-        if hwy_index == len(hwy_coords):
-            continue
-
-        # Get corresponding highway node data
-        hwy_node_id = df_hwy_node.iloc[hwy_index]['node_id']
-        tran_point = Point(tran_coords[i])
-        hwy_point = Point(hwy_coords[hwy_index])
-
-        # Calculate geodesic distance
-        distance = uf.calc_distance_on_unit_sphere(tran_point, hwy_point, "mile")
-
-        # Create access link
-        access_links.append(
-            gmns_geo.Link(
-                id = f"{tran_node_id}", 
-                name = "transit_access_link",
-                from_node_id=tran_node_id,
-                to_node_id=int (hwy_node_id),
-                length=distance,
-                lanes=1,
-                dir_flag = 0,
-                free_speed= 2.72727, #4 *3600 / 5280
-                capacity= 0,
-                allowed_uses='t',
-                geometry=LineString([tran_point, hwy_point])
-            )
-        )
-
-    # Convert to DataFrame
-    return pd.DataFrame([link.__dict__ for link in access_links]) if access_links else pd.DataFrame()
\ No newline at end of file
+    hwy_coords = df_hwy_node[['x_coord', 'y_coord']].to_numpy(dtype=np.float64, copy=False)
+    hwy_ids = df_hwy_node['node_id'].to_numpy()
+    tran_coords = df_tran_node.loc[mask, ['x_coord', 'y_coord']].to_numpy(dtype=np.float64, copy=False)
+    tran_ids = df_tran_node.loc[mask, 'node_id'].to_numpy()
+
+    # Project lon/lat to a local equirectangular frame (meter) around the highway network,
+    # so that the KDTree distance and distance_upper_bound are in meters.
+    # cKDTree works on C-contiguous float64 data, one broadcast multiply gives exactly that without further copies
+    # (around the transit nodes if the highway node file has no rows, the empty KDTree then matches nothing)
+    lat0 = np.deg2rad((hwy_coords if len(hwy_coords) else tran_coords)[:, 1].mean())
+    scale = np.array([111320 * np.cos(lat0), 110540])  # meter per degree of longitude, latitude
+    hwy_xy = np.multiply(hwy_coords, scale, order="C")
+    tran_xy = np.multiply(tran_coords, scale, order="C")
+
+    # Bus service nodes of different routes often share a stop location,
+    # query each distinct location once and scatter the result back to all transit nodes
+    uniq_xy, inverse = np.unique(tran_xy, axis=0, return_inverse=True)
+    uniq_indices = np.empty(len(uniq_xy), dtype=np.intp)
+
+    if 0 < len(hwy_xy) < BRUTE_FORCE_MAX_HWY_NODES:
+        # Small highway network: scan all distances, vectorized over contiguous arrays
+        for start in range(0, len(uniq_xy), BRUTE_FORCE_BLOCK_SIZE):
+            block = slice(start, start + BRUTE_FORCE_BLOCK_SIZE)
+            _, uniq_indices[block] = _query_nearest_brute_force(hwy_xy, uniq_xy[block], 10000)
+    else:
+        # Build KDTree for highway nodes (fast nearest neighbor search),
+        # sliding midpoint splits without node compaction keep the build cheap
+        tree = cKDTree(hwy_xy, leafsize=32, balanced_tree=False, compact_nodes=False)
+
+        for start in range(0, len(uniq_xy), QUERY_BLOCK_SIZE):
+            block = slice(start, start + QUERY_BLOCK_SIZE)
+
+            # Query each location to find the nearest highway node within 10 km (all cores, GIL released)
+            _, uniq_indices[block] = tree.query(uniq_xy[block], k=1, distance_upper_bound=10000, workers=-1)
+    tran_indices = uniq_indices[inverse.reshape(-1)]
+
+    tran_id_blocks, hwy_id_blocks, dist_blocks, geom_blocks = [], [], [], []
+    for start in range(0, len(tran_xy), QUERY_BLOCK_SIZE):
+        block = slice(start, start + QUERY_BLOCK_SIZE)
+        indices = tran_indices[block]
+
+        # Ignore transit nodes without a valid highway node within the radius (index == len(hwy_coords))
+        valid = indices < len(hwy_coords)
+        hwy_index = indices[valid]
+        tran_valid = tran_coords[block][valid]
+        hwy_valid = hwy_coords[hwy_index]
+        tran_id_blocks.append(tran_ids[block][valid])
+        hwy_id_blocks.append(hwy_ids[hwy_index])
+
+        # Calculate geodesic distance (mile) for all matched pairs of the block in one pass
+        dist_blocks.append(haversine_distance(tran_valid[:, 0], tran_valid[:, 1], hwy_valid[:, 0], hwy_valid[:, 1]))
+
+        # Build all access link geometries in one GEOS call, shape (M, 2, 2): [transit point, highway point]
+        if geometry != 'none':
+            geoms = shapely.linestrings(np.stack([tran_valid, hwy_valid], axis=1))
+            # full precision WKT, same text as str(LineString)
+            geom_blocks.append(shapely.to_wkt(geoms, rounding_precision=-1) if geometry == 'wkt' else geoms)
+
+    tran_ids = np.concatenate(tran_id_blocks)
+
+    # Create access links column-wise, scalar attributes broadcast to all rows
+    # (an empty frame with the link columns if no transit node matched)
+    access_link_df = pd.DataFrame({
+        "id": tran_ids.astype(str),
+        "name": "transit_access_link",
+        "from_node_id": tran_ids,
+        "to_node_id": np.concatenate(hwy_id_blocks),
+        "length": np.concatenate(dist_blocks),
+        "lanes": 1,
+        "dir_flag": 0,
+        "free_speed": 2.72727,  # 4 *3600 / 5280
+        "capacity": 0,
+        "allowed_uses": "t",
+    })
+    if geometry != 'none':
+        access_link_df["geometry"] = np.concatenate(geom_blocks)
+    return access_link_df
@@ -0,0 +1,69 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# Created Date: Wednesday, October 14th 2026
+# Contact Info: luoxiangyong01@gmail.com
+# Author/Copyright: Mr. Xiangyong Luo
+##############################################################
+
+import numpy as np
+
+# numba is optional, fall back to vectorized numpy if not installed
+# (njit is None then, callers check it before using any compiled kernel)
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
+# earth radius (mile) of data_convert.calculate_distance_from_geometry
+EARTH_RADIUS_MILE = 6371 * 1000 / 1609.34
+
+
+def _haversine_numpy(lon1: np.ndarray, lat1: np.ndarray, lon2: np.ndarray, lat2: np.ndarray,
+                     earth_radius: float) -> np.ndarray:
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * earth_radius * np.arcsin(np.sqrt(a))
+
+
+def haversine_scalar(lon1: float, lat1: float, lon2: float, lat2: float, earth_radius: float) -> float:
+    """great-circle distance between two WGS84 points, compiled and inlined into the numba kernels calling it"""
+    deg_to_rad = np.pi / 180.0
+    phi1 = lat1 * deg_to_rad
+    phi2 = lat2 * deg_to_rad
+    d_phi = phi2 - phi1
+    d_lambda = (lon2 - lon1) * deg_to_rad
+    a = np.sin(d_phi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(d_lambda / 2) ** 2
+    return 2 * earth_radius * np.arcsin(np.sqrt(a))
+
+
+if njit is not None:
+    haversine_scalar = njit(inline='always', cache=True)(haversine_scalar)
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _haversine_numba(lon1: np.ndarray, lat1: np.ndarray, lon2: np.ndarray, lat2: np.ndarray,
+                         earth_radius: float) -> np.ndarray:
+        distance = np.empty(lon1.shape[0])
+        for i in prange(lon1.shape[0]):
+            distance[i] = haversine_scalar(lon1[i], lat1[i], lon2[i], lat2[i], earth_radius)
+        return distance
+
+
+def haversine_distance(lon1: np.ndarray, lat1: np.ndarray, lon2: np.ndarray, lat2: np.ndarray,
+                       earth_radius: float = 3960.0) -> np.ndarray:
+    """calculate the element-wise great-circle distance between two sets of WGS84 points
+
+    Args:
+        lon1 (np.ndarray): longitudes of the first set of points
+        lat1 (np.ndarray): latitudes of the first set of points
+        lon2 (np.ndarray): longitudes of the second set of points
+        lat2 (np.ndarray): latitudes of the second set of points
+        earth_radius (float, optional): earth radius, determines the output unit. Defaults to 3960.0 (mile).
+
+    Returns:
+        np.ndarray: the distance between each pair of points
+    """
+    lon1, lat1, lon2, lat2 = (np.ascontiguousarray(x, dtype=np.float64) for x in (lon1, lat1, lon2, lat2))
+    if njit is not None:
+        return _haversine_numba(lon1, lat1, lon2, lat2, float(earth_radius))
+    return _haversine_numpy(lon1, lat1, lon2, lat2, earth_radius)
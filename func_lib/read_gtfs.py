@@ -5,15 +5,43 @@
 # Author/Copyright: Mr. Xiangyong Luo
 ##############################################################
 
-import datetime
 import os
 
 import pandas as pd
 
-from .data_convert import (determine_terminal_flag,
-                                             stop_sequence_label)
-from gtfs2gmns.utility_lib import validate_time_period
-from pyufunc import func_running_time, get_filenames_by_ext, path2linux #,check_files_existence
+from gtfs2gmns.utility_lib import (func_running_time, validate_time_period, path2linux, iter_files_from_folder,
+                                   check_required_files_exist, DEFAULT_CSV_READ_ENGINE)
+
+# csv engine of the GTFS files, pyarrow if installed
+GTFS_CSV_ENGINE = DEFAULT_CSV_READ_ENGINE
+
+# arrival_time and departure_time are read as text, in format HH:MM:SS and possibly after 24:00:00,
+# so that no engine infers them as time of day
+STOP_TIME_DTYPE = {'arrival_time': str, 'departure_time': str}
+
+
+def convert_time_str_to_HMS(time_str: pd.Series) -> pd.Series:
+    """convert GTFS times (H:MM:SS or HH:MM:SS, possibly after 24:00:00) to datetimes on 1900-01-01
+
+    Examples:
+        >>> convert_time_str_to_HMS(pd.Series(['7:50:00', '23:59:59', '24:00:00', '25:10:00'])).tolist()
+        [Timestamp('1900-01-01 07:50:00'), Timestamp('1900-01-01 23:59:59'), Timestamp('1900-01-02 00:00:00'), Timestamp('1900-01-02 01:10:00')]
+
+    Raises:
+        Exception: "Error: input time ..., standard time format: 04:20:22."
+    """
+
+    # the string format of time is HH:MM:SS
+    # Check whether the time correct format
+    time_str = time_str.astype(str)
+    invalid_format = ~time_str.str.len().isin([7, 8])
+    if invalid_format.any():
+        raise Exception(f"Error: input time {time_str[invalid_format].iloc[0]}, standard time format: 04:20:22.")
+
+    # convert the whole column at once: the time is a timedelta after midnight of 1900-01-01,
+    # the same base date as the period bounds of validate_time_period, so the two compare directly.
+    # times from 24:00:00 on land on the next day, one-digit hours (7:50:00) parse as written
+    return pd.Timestamp(1900, 1, 1) + pd.to_timedelta(time_str.str.strip())
 
 
 @func_running_time
@@ -43,9 +71,10 @@ def read_gtfs_single(gtfs_dir_single: str, time_period: str, required_files: lis
 
     print(f"Info: Checking if required files exist in the folder: \n    :{gtfs_dir_single}")
 
-    txt_files_from_folder_abspath = get_filenames_by_ext(gtfs_dir_single, file_ext=".txt")
-    #if not check_files_existence(list(required_files_dict.values()), txt_files_from_folder_abspath):
-        #raise Exception("Error: Required files not exist in the folder!")
+    # the txt files of the folder are consumed straight into the set lookup of the check, no intermediate list
+    txt_files_from_folder_abspath = iter_files_from_folder(gtfs_dir_single)
+    if not check_required_files_exist(list(required_files_dict.values()), txt_files_from_folder_abspath):
+        raise Exception("Error: Required files not exist in the folder!")
 
     # Step 2: Check and Format time period
     period_start_time, period_end_time = validate_time_period(time_period)
@@ -53,24 +82,24 @@ def read_gtfs_single(gtfs_dir_single: str, time_period: str, required_files: lis
     # Step 3: read GTFS data
     # Step 3.1 read agency.txt
     print("     : Reading agency.txt...")
-    agency_df = pd.read_csv(required_files_dict.get("agency.txt"), encoding='utf-8-sig')
+    agency_df = pd.read_csv(required_files_dict.get("agency.txt"), encoding='utf-8-sig', engine=GTFS_CSV_ENGINE)
     agency_name = agency_df['agency_name'][0]
 
     # Step 3.2 read stops.txt
     print("     : Reading stops.txt...")
-    stop_df = pd.read_csv(required_files_dict.get("stops.txt"), encoding='utf-8-sig')
+    stop_df = pd.read_csv(required_files_dict.get("stops.txt"), encoding='utf-8-sig', engine=GTFS_CSV_ENGINE)
     stop_df["agency"] = agency_name
     # stop_df = stop_df[['stop_id', 'stop_name', 'stop_lat', 'stop_lon']]
 
     # Step 3.3 read routes.txt
     print("     : Reading routes.txt...")
-    route_df = pd.read_csv(required_files_dict.get("routes.txt"), encoding='utf-8-sig')
+    route_df = pd.read_csv(required_files_dict.get("routes.txt"), encoding='utf-8-sig', engine=GTFS_CSV_ENGINE)
     route_df["agency"] = agency_name
     # route_df = route_df[['route_id', 'route_short_name', 'route_long_name', 'route_type']]
 
     # Step 3.4 read trips.txt
     print("     : Reading trips.txt...")
-    trip_df = pd.read_csv(required_files_dict.get("trips.txt"), encoding='utf-8-sig')
+    trip_df = pd.read_csv(required_files_dict.get("trips.txt"), encoding='utf-8-sig', engine=GTFS_CSV_ENGINE)
     trip_df["trip_id"] = trip_df["trip_id"].astype(str)
     trip_df["agency"] = agency_name
 
@@ -80,7 +109,7 @@ def read_gtfs_single(gtfs_dir_single: str, time_period: str, required_files: lis
 
     # Deal with special issues of direction_id exists but all values are NaN
     try:
-        trip_df['direction_id'] = trip_df.apply(lambda x: str(2 - int(x['direction_id'])), axis=1)
+        trip_df['direction_id'] = (2 - trip_df['direction_id'].astype(int)).astype(str)
     except Exception:
         trip_df['direction_id'] = "0"
 
@@ -90,9 +119,7 @@ def read_gtfs_single(gtfs_dir_single: str, time_period: str, required_files: lis
     # add a new field directed_route_id
     # deal with special issues of Agency 12 Fairfax CUE # Alicia, Nov 10:
     # route file has route id with quotes, e.g., '"green2"' while trip file does not have it, e.g.,'green2'
-    directed_route_id = trip_df['route_id'].astype(str).str.cat(
-        trip_df['direction_id'].astype(str), sep='.')
-    trip_df['directed_route_id'] = directed_route_id
+    trip_df['directed_route_id'] = trip_df['route_id'].astype(str) + '.' + trip_df['direction_id']
 
     # deal with special issues with route_id in two dataframes have different formats
     route_df["route_id"] = route_df["route_id"].astype(str)
@@ -101,87 +128,59 @@ def read_gtfs_single(gtfs_dir_single: str, time_period: str, required_files: lis
     # make route_id in two dataframes have the same format
     if (route_df['route_id'][0][0] == '"') != (trip_df['route_id'][0][0] == '"'):
         if route_df['route_id'][0][0] == '"':
-            route_df['route_id'] = route_df.apply(lambda x: x['route_id'].strip('"'), axis=1)
+            route_df['route_id'] = route_df['route_id'].str.strip('"')
         else:
-            trip_df['route_id'] = trip_df.apply(lambda x: x['route_id'].strip('"'), axis=1)
+            trip_df['route_id'] = trip_df['route_id'].str.strip('"')
 
     # Left merge, as route is higher level planning than trips, len(trip_route_df)=len(trip_df)
-    trip_route_df = pd.merge(trip_df, route_df, on='route_id')
+    # join on the route_id index of route_df, rows and columns as pd.merge(trip_df, route_df, on='route_id')
+    trip_route_df = trip_df.join(route_df.set_index('route_id'), on='route_id', how='inner',
+                                 lsuffix='_x', rsuffix='_y').reset_index(drop=True)
     trip_route_df["trip_id"] = trip_route_df["trip_id"].astype(str)
 
     # Step 3.5 read stop_times.txt
     print("     : Reading stop_times.txt...\n")
-    stop_time_df = pd.read_csv(required_files_dict.get("stop_times.txt"), encoding='utf-8-sig')
+    stop_time_df = pd.read_csv(required_files_dict.get("stop_times.txt"), encoding='utf-8-sig',
+                               dtype=STOP_TIME_DTYPE, engine=GTFS_CSV_ENGINE)
     stop_time_df["agency"] = agency_name
 
     # drop the stations without accurate arrival and departure time.
-    # drop nan
-    stop_time_df = stop_time_df.dropna(subset=['arrival_time'], how='any')
-
-    # drop '' and ' '
-    stop_time_df = stop_time_df[~stop_time_df.arrival_time.isin(['', ' '])]
-    stop_time_df = stop_time_df[~stop_time_df.departure_time.isin(['', ' '])]
+    # nan arrival time, '' and ' ' arrival or departure time, all in one mask and one filter pass
+    arrival_time = stop_time_df['arrival_time']
+    departure_time = stop_time_df['departure_time']
+    is_timed = arrival_time.notna() & ~arrival_time.isin(['', ' ']) & ~departure_time.isin(['', ' '])
+    stop_time_df = stop_time_df[is_timed]
 
-    def convert_time_str_to_HMS(time_str: str) -> datetime.datetime:
+    stop_time_df['arrival_time'] = convert_time_str_to_HMS(stop_time_df['arrival_time'])
+    stop_time_df['departure_time'] = convert_time_str_to_HMS(stop_time_df['departure_time'])
 
-        # initialize flag for adding one day
-        add_one_day = False
-
-        # the string format of time is HH:MM:SS
-        # Check whether the time correct format
-        if len(time_str) not in {7, 8}:
-            raise Exception(f"Error: input time {time_str}, standard time format: 04:20:22.")
-
-        # check whether to add one day for the time 24:00:00
-        if time_str >= '24:00:00':
-            add_one_day = True
-
-            # update the time string to 00 for a new day
-            if len(time_str) == 7:
-                time_str = "0" + time_str[1:]
-            elif len(time_str) == 8:
-                time_str = "00" + time_str[2:]
-            else:
-                raise Exception(f"Error: input time {time_str}, standard time format: 04:20:22.")
-
-        # convert the time string to datetime format
-        time_dt = datetime.datetime.strptime(time_str.strip(), '%H:%M:%S')
-
-        # add one day if necessary
-        if add_one_day:
-            time_dt += datetime.timedelta(days=1)
-
-        return time_dt
-
-    stop_time_df['arrival_time'] = stop_time_df['arrival_time'].apply(
-        lambda x: convert_time_str_to_HMS(x))
-    stop_time_df['departure_time'] = stop_time_df['departure_time'].apply(
-        lambda x: convert_time_str_to_HMS(x))
-
-    iteration_group = stop_time_df.groupby(['trip_id'])
     # mark terminal flag for each stop. The terminals can only be determined at the level of trips
+    # all per-trip steps below run as grouped column operations on the frame sorted by trip and stop sequence
+    stop_time_df_with_terminal = stop_time_df.sort_values(by=['trip_id', 'stop_sequence'], kind='stable')
+    trip_group = stop_time_df_with_terminal.groupby('trip_id', sort=False)
 
-    input_list = []
-    for trip_id, trip_stop_time_df in iteration_group:
-        trip_stop_time_df = trip_stop_time_df.sort_values(
-            by=['stop_sequence'])
-        trip_stop_time_df = trip_stop_time_df.reset_index()
-
-        # select only the trips within the provided time window
-        mask1 = trip_stop_time_df.arrival_time.max() <= period_start_time
-        mask2 = trip_stop_time_df.arrival_time.min() >= period_end_time
-        if not mask1 and not mask2:
-            input_list.append(trip_stop_time_df)
+    # select only the trips within the provided time window
+    mask1 = trip_group['arrival_time'].transform('max') <= period_start_time
+    mask2 = trip_group['arrival_time'].transform('min') >= period_end_time
+    stop_time_df_with_terminal = stop_time_df_with_terminal[~mask1 & ~mask2].reset_index(drop=True)
 
     # check if there is any trip within the provided time window
     # if not, raise an error
-    if not input_list:
+    if stop_time_df_with_terminal.empty:
         raise Exception("Error: no trips are within the provided time window, please check/change the time window from input.")
 
-    intermediate_output_list = list(map(determine_terminal_flag, input_list))
-    output_list = list(map(stop_sequence_label, intermediate_output_list))
+    stop_time_df_with_terminal['stop_sequence'] = stop_time_df_with_terminal['stop_sequence'].astype('int32')
+    trip_group = stop_time_df_with_terminal.groupby('trip_id', sort=False)['stop_sequence']
 
-    stop_time_df_with_terminal = pd.concat(output_list, axis=0)
+    # terminal_flag: first or last stop of the trip
+    stop_sequence = stop_time_df_with_terminal['stop_sequence']
+    stop_time_df_with_terminal['terminal_flag'] = \
+        ((stop_sequence == trip_group.transform('min')) |
+         (stop_sequence == trip_group.transform('max'))).astype('int32')
+
+    # stop_sequence_label: all stop sequences of the trip joined by ';', identical for every stop of the trip
+    sequence_label = stop_sequence.astype(str).groupby(stop_time_df_with_terminal['trip_id'], sort=False).agg(';'.join)
+    stop_time_df_with_terminal['stop_sequence_label'] = stop_time_df_with_terminal['trip_id'].map(sequence_label)
     stop_time_df_with_terminal["trip_id"] = stop_time_df_with_terminal["trip_id"].astype(str)
 
     # print("Info: merge the route information with trip information...")
@@ -196,8 +195,10 @@ def read_gtfs_single(gtfs_dir_single: str, time_period: str, required_files: lis
     # stop_id (spatial location of the vehicle)
     # arrival_time,departure_time (time index of the vehicle)
 
-    directed_route_stop_id = directed_trip_route_stop_time_df['directed_route_id'].astype(
-        str).str.cat(directed_trip_route_stop_time_df['stop_id'].astype(str), sep='.')
+    # the three ids below share their parts, each part is converted to string once
+    directed_route_id = directed_trip_route_stop_time_df['directed_route_id'].astype(str)
+    stop_sequence_label = directed_trip_route_stop_time_df['stop_sequence_label'].astype(str)
+    directed_route_stop_id = directed_route_id + '.' + directed_trip_route_stop_time_df['stop_id'].astype(str)
 
     # directed_route_stop_id is a unique id to identify the route, direction, and stop of a vehicle at a time point
     directed_trip_route_stop_time_df['directed_route_stop_id'] = directed_route_stop_id
@@ -207,18 +208,14 @@ def read_gtfs_single(gtfs_dir_single: str, time_period: str, required_files: lis
 
     # two important concepts :
     # 1 directed_service_stop_id (directed_route_stop_id + stop sequence)
-    directed_trip_route_stop_time_df['directed_service_stop_id'] = \
-        directed_trip_route_stop_time_df.directed_route_stop_id.astype(str) + ':' + \
-        directed_trip_route_stop_time_df.stop_sequence_label
+    directed_trip_route_stop_time_df['directed_service_stop_id'] = directed_route_stop_id + ':' + stop_sequence_label
 
     # 2. directed service id (directed_route_id + stop sequence) same directed route id might have different sequences
-    directed_trip_route_stop_time_df['directed_service_id'] = \
-        directed_trip_route_stop_time_df.directed_route_id.astype(str) + ':' + \
-        directed_trip_route_stop_time_df.stop_sequence_label
+    directed_trip_route_stop_time_df['directed_service_id'] = directed_route_id + ':' + stop_sequence_label
 
-    # attach stop name and geometry for stops
-    directed_trip_route_stop_time_df = pd.merge(
-        directed_trip_route_stop_time_df, stop_df, on='stop_id', suffixes=('_x1', '_y1'))
+    # attach stop name and geometry for stops, joined on the stop_id index of stop_df
+    directed_trip_route_stop_time_df = directed_trip_route_stop_time_df.join(
+        stop_df.set_index('stop_id'), on='stop_id', how='inner', lsuffix='_x1', rsuffix='_y1').reset_index(drop=True)
     directed_trip_route_stop_time_df['agency_name'] = agency_name
 
     return {"agency": agency_df, "stops": stop_df, "routes": route_df,
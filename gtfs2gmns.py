@@ -6,12 +6,22 @@
 ##############################################################
 
 import os
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from .func_lib.read_gtfs import read_gtfs_single
 from .func_lib.gen_node_link import create_nodes, create_service_boarding_links, create_transferring_links
 from .func_lib.generate_access_link import generate_access_link
-from .utility_lib import (validate_time_period)
-from pyufunc import func_running_time
+from .utility_lib import (func_running_time, validate_time_period, save_csv, save_geometry_parquet,
+                          keep_last_pair_mask, PYARROW_AVAILABLE)
+
+# output names of the link columns, in the column order of the link blocks from func_lib.gen_node_link,
+# built once at import as an (immutable) Index, assigned as is to every link frame
+_LINK_COLS = pd.Index(['id', 'from_node_id', 'to_node_id',
+                       'transit_type',  # 'facility_type'
+                       'dir_flag', 'directed_route_id', 'link_type', 'name', 'length', 'lanes', 'capacity',
+                       'free_speed', 'cost', 'VDF_fftt1', 'VDF_cap1', 'VDF_alpha1', 'VDF_beta1', 'VDF_penalty1',
+                       'geometry', 'allowed_uses', 'agency_name', 'stop_sequence', 'directed_service_id'])
 
 
 class GTFS2GMNS:
@@ -264,7 +274,14 @@ class GTFS2GMNS:
         return None
 
     @func_running_time
-    def gen_gmns_nodes_links(self) -> list:
+    def gen_gmns_nodes_links(self, csv_engine: str = "pandas", gzip_csv: bool = False,
+                             geometry_parquet: bool = False, link_float_format: str = None) -> list:
+
+        # step 0. check the output options before any work, bad options fail without partial output
+        if csv_engine not in {'pandas', 'pyarrow'}:
+            raise ValueError('csv_engine should be one of "pandas", "pyarrow".')
+        if geometry_parquet and not PYARROW_AVAILABLE:
+            raise ImportError("pyarrow is required to write parquet files, please install pyarrow.")
 
         # step 1. prepare gmns node and link
         try:
@@ -298,53 +315,51 @@ class GTFS2GMNS:
 
         # transferring links
         all_link_lst = create_transferring_links(all_node_df, all_link_lst)
-        all_link_df = pd.DataFrame(all_link_lst)
-
-        all_link_df.rename(columns={0: 'id',
-                                    1: 'from_node_id',
-                                    2: 'to_node_id',
-                                    3: 'transit_type', #'facility_type'
-                                    4: 'dir_flag',
-                                    5: 'directed_route_id',
-                                    6: 'link_type',
-                                    7: 'name',
-                                    8: 'length',
-                                    9: 'lanes',
-                                    10: 'capacity',
-                                    11: 'free_speed',
-                                    12: 'cost',
-                                    13: 'VDF_fftt1',
-                                    14: 'VDF_cap1',
-                                    15: 'VDF_alpha1',
-                                    16: 'VDF_beta1',
-                                    17: 'VDF_penalty1',
-                                    18: 'geometry',
-                                    19: 'allowed_uses',
-                                    20: 'agency_name',
-                                    21: 'stop_sequence',
-                                    22: 'directed_service_id'}, inplace=True)
-
-        all_link_df = all_link_df.drop_duplicates(
-            subset=['from_node_id', 'to_node_id'], keep='last').reset_index(drop=True)
+        # concat and label the link blocks in one chain, set_axis swaps the column labels without copying data
+        all_link_df = pd.concat(all_link_lst, ignore_index=True).set_axis(_LINK_COLS, axis='columns')
+
+        # smallest unsigned integer dtype for node ids and small integer codes, less to hash and write
+        for col in ('from_node_id', 'to_node_id', 'link_type', 'lanes'):
+            all_link_df[col] = pd.to_numeric(all_link_df[col], downcast='unsigned')
+
+        # keep the last link of each (from_node_id, to_node_id), only the two key columns are hashed
+        is_last_link = keep_last_pair_mask(all_link_df, 'from_node_id', 'to_node_id')
+        all_link_df = all_link_df[is_last_link]
         
         # step 4. save node and link data
         # create node and link result path
         if self.isSaveToCSV:
             
-            if os.path.exists("node_transit.csv"):
-                os.remove("node_transit.csv")
-
-            if os.path.exists("link_transit.csv"):
-                os.remove("link_transit.csv")
+            # remove stale results in the working directory, one unlink per file instead of a stat and an unlink
+            for stale_csv in ("node_transit.csv", "link_transit.csv"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(stale_csv)
                 
-            node_csv_path = os.path.join(self.gtfs_output_dir, "node_transit.csv")
-            link_csv_path = os.path.join(self.gtfs_output_dir, "link_transit.csv")
+            # gzip_csv saves node_transit.csv.gz and link_transit.csv.gz instead
+            csv_suffix = ".gz" if gzip_csv else ""
+            node_csv_path = os.path.join(self.gtfs_output_dir, "node_transit.csv" + csv_suffix)
+            link_csv_path = os.path.join(self.gtfs_output_dir, "link_transit.csv" + csv_suffix)
             
-            all_node_df.to_csv(node_csv_path, index=False)   
-            all_link_df = all_link_df.drop_duplicates(
-                    subset=['from_node_id', 'to_node_id'],
-                    keep='last').reset_index(drop=True)
-            all_link_df.to_csv(link_csv_path, index=False)
+            # csv_engine "pyarrow" writes faster, with all strings quoted (see utility_lib.save_csv)
+            # link_float_format (e.g. "%.6g") rounds the float link attributes (length, free_speed, ...) when saving,
+            # node coordinates are always saved in full precision
+            # the files are independent, write them concurrently (file writes release the GIL)
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                save_futures = [executor.submit(save_csv, all_node_df, node_csv_path, engine=csv_engine)]
+                if geometry_parquet:
+                    # link geometry as WKB in link_transit_geometry.parquet, keyed by from/to node id,
+                    # link_transit.csv without the geometry column
+                    geometry_parquet_path = os.path.join(self.gtfs_output_dir, "link_transit_geometry.parquet")
+                    save_futures += [
+                        executor.submit(save_geometry_parquet, all_link_df, geometry_parquet_path,
+                                        ['id', 'from_node_id', 'to_node_id']),
+                        executor.submit(save_csv, all_link_df.drop(columns='geometry'), link_csv_path,
+                                        engine=csv_engine, float_format=link_float_format)]
+                else:
+                    save_futures.append(executor.submit(save_csv, all_link_df, link_csv_path,
+                                                        engine=csv_engine, float_format=link_float_format))
+                for future in save_futures:
+                    future.result()
 
             print(f"Info: successfully converted gtfs data to node and link data:\n{node_csv_path} \n{link_csv_path}")
         
@@ -358,14 +373,16 @@ class GTFS2GMNS:
         "learn from package: gtfs_segments"
         return None
 
-    def generate_access_link(self, hwy_node_path: str, tran_node_path: str) -> pd.DataFrame:
+    def generate_access_link(self, hwy_node_path: str, tran_node_path: str,
+                             geometry: str = "wkt") -> pd.DataFrame:
         """Generate access links between the transit bus service nodes and the nearest node in another network.
 
         Args:
             hwy_node_path (str): file path to hwy network node flie, or another network to connect the trasnit to
             tran_node_path (str): file path to transit network node file
+            geometry (str, optional): geometry column format, "wkt", "shapely" or "none". Defaults to "wkt".
 
         Returns:
             pd.DataFrame: _description_
         """
-        return generate_access_link(hwy_node_path, tran_node_path)
\ No newline at end of file
+        return generate_access_link(hwy_node_path, tran_node_path, geometry=geometry)
\ No newline at end of file
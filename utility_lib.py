@@ -5,7 +5,112 @@
 # Author/Copyright: Mr. Xiangyong Luo
 ##############################################################
 
+import os
+import time
 import datetime
+import gzip
+from functools import wraps
+from typing import Iterable, Iterator, Literal
+
+import numpy as np
+import pandas as pd
+import shapely
+
+# pyarrow is optional, needed by the "pyarrow" csv engine of save_csv and by save_geometry_parquet.
+# If installed, the csv files are also read with its multi-threaded engine (DEFAULT_CSV_READ_ENGINE)
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pa_parquet
+    PYARROW_AVAILABLE = True
+except ImportError:
+    pa = None
+    PYARROW_AVAILABLE = False
+
+DEFAULT_CSV_READ_ENGINE = "pyarrow" if PYARROW_AVAILABLE else "c"
+
+# rows formatted per chunk and file buffer size (byte) of the csv outputs
+CSV_CHUNK_SIZE = 100_000
+CSV_BUFFER_SIZE = 1 << 20
+
+
+def func_running_time(func: object) -> object:
+    """decorator to print the running time of a function or class method
+
+    Args:
+        func (object): the function or class method to be measured
+
+    Returns:
+        object: the decorated function or class method, with the name and docstring of func
+    """
+
+    @wraps(func)
+    def inner(*args, **kwargs):
+        # perf_counter is monotonic and sub-microsecond, report milliseconds
+        time_start = time.perf_counter()
+        res = func(*args, **kwargs)
+        print(f"  :INFO: finished function: {func.__name__}, total: {time.perf_counter() - time_start:.3f}s \n")
+        return res
+
+    return inner
+
+
+def path2linux(path: str) -> str:
+    """convert path to an absolute linux style path (forward slashes) for all OSes
+
+    Args:
+        path (str | Path): the path to convert
+
+    Returns:
+        str: absolute path with "/" as the separator
+    """
+    # os.path.abspath always returns str (Path input included), no type check or exception needed
+    return os.path.abspath(path).replace("\\", "/")
+
+
+def iter_files_from_folder(dir_name: str, file_type: str = "txt", incl_subdir: bool = False) -> Iterator[str]:
+    """lazily yield the (linux style) absolute paths of all files with the given extension in a folder
+
+    Args:
+        dir_name (str): the folder to search
+        file_type (str, optional): the file extension, without the dot. Defaults to "txt".
+        incl_subdir (bool, optional): whether to search sub folders as well. Defaults to False.
+
+    Yields:
+        str: absolute path of each matched file
+    """
+    suffix = f".{file_type}"
+
+    if incl_subdir:
+        for root, _, files in os.walk(dir_name):
+            for file in files:
+                if file.endswith(suffix):
+                    yield path2linux(os.path.join(root, file))
+        return
+
+    # one directory scan, the entry type comes with the scan (no extra stat on most platforms)
+    with os.scandir(dir_name) as entries:
+        for entry in entries:
+            if entry.name.endswith(suffix) and entry.is_file():
+                yield path2linux(entry.path)
+
+
+def check_required_files_exist(required_files: list, dir_files: Iterable[str]) -> bool:
+    """check whether all required files are in the list of files of a folder
+
+    Args:
+        required_files (list): the required files
+        dir_files (Iterable[str]): the files in the folder, any iterable (e.g. iter_files_from_folder)
+
+    Returns:
+        bool: True if all required files exist, else False (missing files are printed)
+    """
+    # one C-level set difference, sorted only on the (cold) error path for a stable message
+    missing_files = frozenset(required_files) - set(dir_files)
+    if not missing_files:
+        return True
+    print(f"Error: Required files are not satisfied, missing files are: {sorted(missing_files)}")
+    return False
 
 
 def validate_time_period(time_period: str) -> list:
@@ -24,3 +129,94 @@ def validate_time_period(time_period: str) -> list:
     period_end_time = datetime.datetime.strptime(period_end_str, '%H:%M:%S')
     return [period_start_time, period_end_time]
 
+
+def save_csv(df: pd.DataFrame, csv_path: str, engine: Literal['pandas', 'pyarrow'] = 'pandas',
+             float_format: str = None) -> None:
+    """save dataframe to csv without index
+
+    Args:
+        df (pd.DataFrame): the dataframe to save
+        csv_path (str): the path of the csv file, a path ending with ".gz" is written gzip compressed (level 1)
+        engine (str, optional): "pandas" formats chunks of rows with to_csv, written through a large buffer,
+            "pyarrow" uses the multi-threaded Arrow csv writer if pyarrow is installed, which quotes all strings
+            and writes floats in shortest form (1.0 as 1). Defaults to "pandas".
+        float_format (str, optional): printf format of float columns for the "pandas" engine, e.g. "%.6g",
+            formatted in one C call per cell instead of repr(). Ignored by the "pyarrow" engine, which always
+            writes floats in shortest form. Defaults to None (full precision repr).
+
+    Raises:
+        ValueError: engine should be one of "pandas", "pyarrow"
+    """
+    if engine not in {'pandas', 'pyarrow'}:
+        raise ValueError('engine should be one of "pandas", "pyarrow".')
+
+    if engine == 'pyarrow' and pa is not None:
+        # Arrow needs one type per column, mixed object columns (e.g. numbers and "" in the same column)
+        # are written as their str(), missing values stay empty
+        df = df.assign(**{col: df[col].map(str, na_action='ignore')
+                          for col in df.columns if df[col].dtype == object})
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if csv_path.endswith('.gz'):
+            # same gzip level 1 as the pandas engine, Arrow's compressed streams only write the default level (6)
+            with gzip.open(csv_path, 'wb', compresslevel=1) as f:
+                pa_csv.write_csv(table, f)
+        else:
+            pa_csv.write_csv(table, csv_path)
+        return None
+
+    if csv_path.endswith('.gz'):
+        # level 1 gzip costs little more than the formatting and shrinks the repetitive text several times
+        df.to_csv(csv_path, index=False, chunksize=CSV_CHUNK_SIZE, float_format=float_format,
+                  compression={'method': 'gzip', 'compresslevel': 1})
+        return None
+
+    with open(csv_path, 'w', buffering=CSV_BUFFER_SIZE, newline='', encoding='utf-8') as f:
+        df.to_csv(f, index=False, chunksize=CSV_CHUNK_SIZE, float_format=float_format)
+    return None
+
+
+def save_geometry_parquet(df: pd.DataFrame, parquet_path: str, key_columns: list) -> None:
+    """save the WKT geometry column of a dataframe as WKB (binary) to parquet, with the key columns to join on
+
+    Args:
+        df (pd.DataFrame): the dataframe with the key columns and a WKT "geometry" column
+        parquet_path (str): the path of the parquet file
+        key_columns (list): the columns identifying each row, saved along with the geometry
+
+    Raises:
+        ImportError: pyarrow is required to write parquet files
+    """
+    if pa is None:
+        raise ImportError("pyarrow is required to write parquet files, please install pyarrow.")
+
+    # one vectorized GEOS pass each for parsing WKT and encoding WKB
+    geometry_wkb = shapely.to_wkb(shapely.from_wkt(df["geometry"].to_numpy()))
+    table = pa.Table.from_pandas(df[key_columns], preserve_index=False)
+    pa_parquet.write_table(table.append_column("geometry", pa.array(geometry_wkb, type=pa.binary())), parquet_path)
+    return None
+
+
+def keep_last_pair_mask(df: pd.DataFrame, first_column: str, second_column: str) -> np.ndarray:
+    """boolean mask of the last row of each (first_column, second_column) pair,
+    same as ~df.duplicated(subset=[first_column, second_column], keep='last')
+
+    Args:
+        df (pd.DataFrame): the dataframe
+        first_column (str): first key column
+        second_column (str): second key column
+
+    Returns:
+        np.ndarray: True for the rows to keep
+    """
+    first = df[first_column].to_numpy()
+    second = df[second_column].to_numpy()
+
+    # non-negative 32-bit integer keys (e.g. node ids) pack into one uint64 key per row,
+    # a single integer hash per row instead of factorizing both columns
+    is_packable = all(arr.dtype.kind in "iu" and (arr.size == 0 or (arr.min() >= 0 and arr.max() < 1 << 32))
+                      for arr in (first, second))
+    if not is_packable:
+        return ~df.duplicated(subset=[first_column, second_column], keep='last').to_numpy()
+
+    key = (first.astype(np.uint64) << np.uint64(32)) | second.astype(np.uint64)
+    return ~pd.Series(key).duplicated(keep='last').to_numpy()